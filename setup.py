@@ -42,6 +42,8 @@ setup(
         'ugrc-palletjack==2.0.*',
         'agrc-supervisor==3.0.*',
         'google-cloud-storage==2.3.*',
+        'paramiko~=3.3',
+        'pyarrow==12.*',
     ],
     extras_require={
         'tests': [
@@ -4,6 +4,7 @@ config.py: Configuration values. Secrets to be handled with Secrets Manager
 
 import logging
 import socket
+from datetime import timedelta
 from pathlib import Path
 
 import numpy as np
@@ -16,9 +17,15 @@ SENDGRID_SETTINGS = {  #: Settings for SendGridHandler
     'prefix': f'ERAP on {socket.gethostname()}: ',
 }
 LOG_LEVEL = logging.DEBUG
+#: Slice size for resumable uploads to Cloud Storage (files over 8 MB); must be a multiple of 256 KB
+GCS_UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
 
 KNOWNHOSTS = f'{Path(__file__).parent.parent.parent}\\known_hosts'
+SFTP_MAX_CONCURRENT_REQUESTS = 64  #: Outstanding read requests per file, same as OpenSSH's sftp -R default
+SFTP_MAX_REQUEST_SIZE = 32768  #: Bytes per read request, same as OpenSSH's sftp -B default
+SFTP_KEEPALIVE_INTERVAL = 30  #: Seconds between keepalives on the cached SSH transport
 ERAP_FILE_NAME = 'ERAP_PAYMENTS.csv'
+ERAP_CSV_BLOCK_SIZE = 1 << 20  #: Bytes of the csv read and sent to AGOL at a time
 ERAP_KEY_COLUMN = 'zip5'
 ERAP_CLASSIFICATION_COLUMN = 'Amount'
 
@@ -26,6 +33,10 @@ ERAP_FEATURE_SERVICE_URL = (
     'https://services1.arcgis.com/99lidPhWCzftIe9K/arcgis/rest/services/ERAP_By_Zipcode/FeatureServer/0'
 )
 ERAP_FEATURE_LAYER_ITEMID = '32f9c17b1ed04157a8a9a0a635f36c64'
+ERAP_UPDATE_BATCH_SIZE = 500  #: Features per applyEdits request
+ERAP_OID_LOOKUP_BLOB_NAME = 'zip5_oid_map.json'  #: Cached {zip5: ObjectID} lookup in the storage bucket
+ERAP_OID_LOOKUP_MAX_AGE = timedelta(days=7)
+ERAP_ROW_HASHES_BLOB_NAME = 'row_hashes.npy'  #: Row hashes of the last fully-applied data in the storage bucket
 ERAP_WEBMAP_ITEMID = 'c14586a1117e4fd1a0865ffa9e3a9a37'
 ERAP_LAYER_NAME = 'Aggregate Paid Rental Assistance Applications'
 
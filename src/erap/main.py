@@ -4,18 +4,29 @@
 Updates the DWS ERAP layer based on their weekly
 """
 
+import functools
+import io
 import json
 import logging
+import os
+import shutil
 import sys
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from os import environ
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from types import SimpleNamespace
 
 import arcgis
+import numpy as np
+import pandas as pd
+import paramiko
+import pyarrow as pa
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
-from palletjack import ColorRampReclassifier, FeatureServiceInlineUpdater, SFTPLoader
+from palletjack import ColorRampReclassifier
+from pyarrow import csv
 from supervisor.message_handlers import SendGridHandler
 from supervisor.models import MessageDetails, Supervisor
 
@@ -30,12 +41,205 @@ except ImportError:
 STORAGE_BUCKET = environ.get('STORAGE_BUCKET')
 
 
+@functools.lru_cache(maxsize=1)
+def _connect_sftp(host, username, password, knownhosts_file):
+    """Open and authenticate a single SSH transport and sftp session; cached so later calls reuse it
+
+    Args:
+        host (str): SFTP server
+        username (str): SFTP username
+        password (str): SFTP password
+        knownhosts_file (str or Path): known_hosts file containing the server's public key
+
+    Returns:
+        tuple(paramiko.SSHClient, paramiko.SFTPClient): The connected client and its sftp session
+    """
+
+    ssh_client = paramiko.SSHClient()
+    #: SSHClient rejects any host key not found in knownhosts_file, just like pysftp's CnOpts
+    ssh_client.load_host_keys(knownhosts_file)
+    try:
+        ssh_client.connect(host, username=username, password=password, look_for_keys=False, allow_agent=False)
+    except Exception:
+        ssh_client.close()
+        raise
+    ssh_client.get_transport().set_keepalive(config.SFTP_KEEPALIVE_INTERVAL)
+
+    return ssh_client, ssh_client.open_sftp()
+
+
+class ReusedSFTP:
+    """Context manager providing an sftp session on a cached, already-authenticated SSH transport.
+
+    The connection handshake and authentication happen once and are shared by the folder listing and every file
+    download. GCF keeps the process alive between invocations, so the connection is deliberately left open on exit
+    for the next run to pick up. A cached connection that has since dropped is discarded and reopened.
+
+    GCF throttles the CPU between invocations, so keepalives don't go out and a weekly run usually finds a half-open
+    transport that still reports itself active. A cheap request on entry catches that before the caller uses it.
+    """
+
+    def __init__(self, host, username, password, knownhosts_file):
+        self.connection_args = (host, username, password, knownhosts_file)
+
+    def __enter__(self):
+        ssh_client, sftp_client = _connect_sftp(*self.connection_args)
+        if not self._is_usable(ssh_client, sftp_client):
+            logging.getLogger('erap').debug('Cached SFTP connection is closed, reconnecting')
+            ssh_client.close()
+            _connect_sftp.cache_clear()
+            ssh_client, sftp_client = _connect_sftp(*self.connection_args)
+
+        return sftp_client
+
+    @staticmethod
+    def _is_usable(ssh_client, sftp_client):
+        transport = ssh_client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        try:
+            sftp_client.normalize('.')
+        except (EOFError, OSError, paramiko.SSHException):
+            return False
+
+        return True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class PipelinedSFTPLoader:  # pylint: disable=too-few-public-methods
+    """Stand-in for palletjack's SFTPLoader that downloads via paramiko's prefetching reads instead of pysftp's get.
+
+    Prefetching keeps up to max_concurrent_requests reads of max_request_size bytes in flight at once, so throughput
+    isn't limited by waiting on a round trip for every request. Files are read straight into memory rather than
+    written to disk and read back.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        host,
+        username,
+        password,
+        knownhosts_file,
+        max_concurrent_requests=64,
+        max_request_size=32768,
+    ):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.knownhosts_file = knownhosts_file
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_request_size = max_request_size
+        self._class_logger = logging.getLogger('erap').getChild(self.__class__.__name__)
+
+    def download_sftp_file_contents(self, filename, sftp_folder='upload'):
+        """Download filename's contents into memory using prefetched reads over the shared connection
+
+        Args:
+            filename (str): Name of the file to download
+            sftp_folder (str, optional): Path of remote folder, relative to sftp home directory. Defaults to 'upload'.
+
+        Raises:
+            FileNotFoundError: If the file or folder doesn't exist on the sftp server
+
+        Returns:
+            bytes: The file's contents
+        """
+
+        remote_path = f'{sftp_folder}/{filename}'
+        self._class_logger.info('Downloading `%s:%s` into memory', self.host, remote_path)
+        self._class_logger.debug('SFTP Username: %s', self.username)
+        buffer = io.BytesIO()
+        with ReusedSFTP(self.host, self.username, self.password, self.knownhosts_file) as sftp_client:
+            try:
+                file_size = sftp_client.stat(remote_path).st_size
+            except FileNotFoundError as error:
+                raise FileNotFoundError(
+                    f'File `{filename}` or folder `{sftp_folder}` not found on SFTP server'
+                ) from error
+            with sftp_client.open(remote_path, 'rb', bufsize=self.max_request_size) as remote_file:
+                #: prefetch() splits the file into MAX_REQUEST_SIZE-sized read requests
+                remote_file.MAX_REQUEST_SIZE = self.max_request_size
+                remote_file.prefetch(file_size, self.max_concurrent_requests)
+                shutil.copyfileobj(remote_file, buffer, length=1 << 20)
+        self._class_logger.debug('Downloaded %s bytes', buffer.tell())
+
+        #: getvalue() hands back the buffer's own bytes rather than a copy once writing is finished
+        return buffer.getvalue()
+
+
+class AttributeColorRampReclassifier(ColorRampReclassifier):  # pylint: disable=too-few-public-methods
+    """ColorRampReclassifier that computes the stops from the layer's attributes alone.
+
+    ColorRampReclassifier loads the entire layer, polygons and all, into a spatial dataframe to compute the stops from
+    a single column. The layer is still found through the webmap's layer_name entry, but it's queried without
+    geometries.
+    """
+
+    def _get_layer_dataframe(self, layer_name, feature_layer_number=0):
+        """Create a dataframe of the attributes of layer_name in self.webmap_item
+
+        Args:
+            layer_name (str): The exact name of the layer
+            feature_layer_number (int): The number of the layer with the feature service to update. Defaults to 0.
+
+        Returns:
+            pd.DataFrame: The layer's attributes, without geometries
+        """
+
+        layer_id = self._get_layer_id(layer_name)
+        layer_item_id = self.webmap_item.get_data()['operationalLayers'][layer_id]['itemId']
+        feature_layer = self.gis.content.get(layer_item_id).layers[feature_layer_number]
+        self._class_logger.info('Querying attributes of `%s` on `%s`', layer_name, self.webmap_item.title)
+        featureset = feature_layer.query(out_fields='*', return_geometry=False)
+
+        return pd.DataFrame([feature.attributes for feature in featureset.features])
+
+
+@functools.lru_cache(maxsize=1)
+def _get_storage_client():
+    """Create the Cloud Storage client once per process so its credentials and connections are reused
+
+    Returns:
+        google.cloud.storage.Client: The shared client
+    """
+
+    return storage.Client()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_gis(org, username, password):
+    """Log into AGOL once per process; GCF keeps the process warm between invocations so later runs reuse the session
+
+    Args:
+        org (str): AGOL organization url
+        username (str): AGOL username
+        password (str): AGOL password
+
+    Returns:
+        arcgis.gis.GIS: The shared AGOL connection
+    """
+
+    return arcgis.gis.GIS(org, username, password)
+
+
 def _initialize(log_path, sendgrid_api_key):
 
+    #: The format doesn't use thread or process info, so don't look them up for every record. lineno is still used, so
+    #: the caller frame lookup stays on.
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    #: Our handlers write everything, so don't pass records on to any root handlers to be formatted again
     erap_logger = logging.getLogger('erap')
     erap_logger.setLevel(config.LOG_LEVEL)
+    erap_logger.propagate = False
     palletjack_logger = logging.getLogger('palletjack')
     palletjack_logger.setLevel(config.LOG_LEVEL)
+    palletjack_logger.propagate = False
 
     cli_handler = logging.StreamHandler(sys.stdout)
     cli_handler.setLevel(config.LOG_LEVEL)
@@ -66,7 +270,40 @@ def _initialize(log_path, sendgrid_api_key):
         SendGridHandler(sendgrid_settings=sendgrid_settings, client_name='erap', client_version=version.__version__)
     )
 
-    return erap_supervisor
+    return erap_supervisor, [cli_handler, log_handler]
+
+
+def _detach_log_handlers(handlers):
+    """Remove handlers from the erap and palletjack loggers and close them
+
+    GCF reuses warm processes, so handlers left attached would repeat every line on the next run and keep writing to
+    this run's (deleted) log file.
+
+    Args:
+        handlers (list): The handlers added by _initialize
+    """
+
+    for logger_name in ('erap', 'palletjack'):
+        logger = logging.getLogger(logger_name)
+        for handler in handlers:
+            logger.removeHandler(handler)
+    for handler in handlers:
+        handler.close()
+
+
+def _upload_file(blob, file_path, content_type):
+    """Upload file_path to blob from a single open handle
+
+    Passing the size up front lets the client send small files in one request instead of starting a resumable upload.
+
+    Args:
+        blob (google.cloud.storage.Blob): Destination blob
+        file_path (Path): File to upload
+        content_type (str): MIME type to store with the blob
+    """
+
+    with open(file_path, 'rb', buffering=1 << 20) as upload_file:
+        blob.upload_from_file(upload_file, size=os.fstat(upload_file.fileno()).st_size, content_type=content_type)
 
 
 def _get_secrets():
@@ -84,87 +321,455 @@ def _get_secrets():
     raise FileNotFoundError('Secrets folder not found; secrets not loaded.')
 
 
+def _read_csv_in_chunks(csv_data, column_types, block_size=1 << 20):
+    """Read header-less csv data block_size bytes at a time so that only one chunk is held in memory
+
+    Like palletjack's SFTPLoader.read_csv_into_dataframe, the column names are taken from column_types. The data is
+    parsed in place by pyarrow's multithreaded streaming reader straight into the requested types, and each block is
+    handed back as a dataframe. Empty strings are read as nulls to match pandas.
+
+    Args:
+        csv_data (bytes): Contents of the csv
+        column_types (dict): Column names and their dtypes (np.float64, str, etc)
+        block_size (int, optional): Approximate size in bytes of the csv read into each chunk. Defaults to 1 MiB.
+
+    Yields:
+        pd.DataFrame: The next chunk of the csv
+    """
+
+    module_logger = logging.getLogger('erap')
+    module_logger.info('Reading %s bytes of csv into dataframes in %s byte blocks', len(csv_data), block_size)
+    read_options = csv.ReadOptions(column_names=list(column_types), block_size=block_size, use_threads=True)
+    arrow_types = {column: pa.from_numpy_dtype(np.dtype(dtype)) for column, dtype in column_types.items()}
+    convert_options = csv.ConvertOptions(column_types=arrow_types, strings_can_be_null=True)
+
+    total_rows = 0
+    #: pyarrow raises ArrowInvalid on an empty file instead of returning no rows
+    if csv_data:
+        csv_buffer = pa.BufferReader(csv_data)
+        with csv.open_csv(csv_buffer, read_options=read_options, convert_options=convert_options) as reader:
+            for batch in reader:
+                chunk = batch.to_pandas()
+                module_logger.debug('Dataframe chunk shape: %s', chunk.shape)
+                total_rows += len(chunk.index)
+                yield chunk
+
+    if not total_rows:
+        module_logger.warning('csv contains no rows')
+
+
+def _get_row_hashes(dataframe):
+    """Hash each row's values with pandas' vectorized hash_pandas_object
+
+    The key column is part of each row, so a row's hash only matches a previous one if both its key and its values
+    are unchanged.
+
+    Args:
+        dataframe (pd.DataFrame): Rows to hash
+
+    Returns:
+        np.ndarray: A uint64 hash for each row
+    """
+
+    return pd.util.hash_pandas_object(dataframe, index=False).to_numpy()
+
+
+def _load_row_hashes(bucket):
+    """Load the row hashes saved after the last fully-applied update
+
+    Args:
+        bucket (google.cloud.storage.Bucket): Bucket holding the saved hashes
+
+    Returns:
+        np.ndarray: The saved uint64 row hashes, empty if there aren't any
+    """
+
+    hashes_blob = bucket.get_blob(config.ERAP_ROW_HASHES_BLOB_NAME)
+    if hashes_blob is None:
+        return np.array([], dtype=np.uint64)
+
+    return np.load(io.BytesIO(hashes_blob.download_as_bytes()))
+
+
+def _save_row_hashes(bucket, row_hashes):
+    """Save row_hashes to bucket so the next run only sends rows that have changed since
+
+    Args:
+        bucket (google.cloud.storage.Bucket): Bucket to save the hashes in
+        row_hashes (np.ndarray): uint64 hashes of the csv rows that are up to date in AGOL
+    """
+
+    hashes_buffer = io.BytesIO()
+    np.save(hashes_buffer, row_hashes)
+    hashes_blob = bucket.blob(config.ERAP_ROW_HASHES_BLOB_NAME)
+    hashes_blob.upload_from_string(hashes_buffer.getvalue(), content_type='application/octet-stream')
+
+
+def _get_key_to_oid_lookup(feature_layer, key_column):
+    """Map each existing feature's key_column value to its ObjectID using a single attribute-only query
+
+    Args:
+        feature_layer (arcgis.features.FeatureLayer): The layer to be updated
+        key_column (str): The field that uniquely identifies each feature
+
+    Returns:
+        dict: {key: ObjectID}
+    """
+
+    oid_field = feature_layer.properties.objectIdField
+    featureset = feature_layer.query(out_fields=key_column, return_geometry=False)
+
+    return {feature.attributes[key_column]: feature.attributes[oid_field] for feature in featureset.features}
+
+
+def _get_cached_oid_lookup(bucket, feature_layer, key_column):
+    """Load the {key: ObjectID} lookup cached in Cloud Storage, rebuilding it from AGOL if it's missing or stale
+
+    Keys rarely change between runs, so downloading a small json blob saves querying the layer for every key. The
+    cache is rebuilt once it's older than config.ERAP_OID_LOOKUP_MAX_AGE, or if its ObjectIDs don't match the layer's
+    (for example, after the layer is overwritten), so that updates can't land on the wrong features.
+
+    Args:
+        bucket (google.cloud.storage.Bucket): Bucket holding the cached lookup
+        feature_layer (arcgis.features.FeatureLayer): The layer to be updated
+        key_column (str): The field that uniquely identifies each feature
+
+    Returns:
+        tuple(dict, bool): {key: ObjectID} and whether it was loaded from the cache
+    """
+
+    module_logger = logging.getLogger('erap')
+    lookup_blob = bucket.get_blob(config.ERAP_OID_LOOKUP_BLOB_NAME)
+    if lookup_blob is not None and datetime.now(timezone.utc) - lookup_blob.updated < config.ERAP_OID_LOOKUP_MAX_AGE:
+        oid_lookup = json.loads(lookup_blob.download_as_bytes())
+        layer_oids = feature_layer.query(return_ids_only=True)['objectIds'] or []
+        if set(oid_lookup.values()) == set(layer_oids):
+            module_logger.debug('Using ObjectID lookup cached at %s', lookup_blob.updated)
+            return oid_lookup, True
+        module_logger.info("Cached ObjectID lookup doesn't match the layer's ObjectIDs")
+
+    return _rebuild_oid_lookup(bucket, feature_layer, key_column), False
+
+
+def _rebuild_oid_lookup(bucket, feature_layer, key_column):
+    """Build the {key: ObjectID} lookup from AGOL and cache it in Cloud Storage
+
+    Args:
+        bucket (google.cloud.storage.Bucket): Bucket to cache the lookup in
+        feature_layer (arcgis.features.FeatureLayer): The layer to be updated
+        key_column (str): The field that uniquely identifies each feature
+
+    Returns:
+        dict: {key: ObjectID}
+    """
+
+    logging.getLogger('erap').info('Rebuilding ObjectID lookup from AGOL')
+    oid_lookup = _get_key_to_oid_lookup(feature_layer, key_column)
+    lookup_blob = bucket.blob(config.ERAP_OID_LOOKUP_BLOB_NAME)
+    lookup_blob.upload_from_string(json.dumps(oid_lookup), content_type='application/json')
+
+    return oid_lookup
+
+
+def _build_updates(dataframe, key_column, oid_field, oid_lookup):
+    """Build applyEdits update dicts for the rows in dataframe whose key is in oid_lookup
+
+    Nulls are sent as None because the REST API doesn't accept NaN.
+
+    Args:
+        dataframe (pd.DataFrame): New data; every column is written to the field of the same name
+        key_column (str): The field that uniquely identifies each feature
+        oid_field (str): The layer's ObjectID field
+        oid_lookup (dict): {key: ObjectID} for the existing features
+
+    Returns:
+        tuple(list, list): The update dicts and the keys that weren't found in oid_lookup
+    """
+
+    updates = []
+    keys_not_found = []
+    for row in dataframe.astype(object).where(dataframe.notna(), None).to_dict('records'):
+        object_id = oid_lookup.get(row[key_column])
+        if object_id is None:
+            keys_not_found.append(row[key_column])
+            continue
+        updates.append({'attributes': {oid_field: object_id, **row}})
+
+    return updates, keys_not_found
+
+
+def _update_features_in_batches(feature_layer, dataframe, key_column, oid_lookup, batch_size):
+    """Update existing features with dataframe's values, sending batch_size features per applyEdits request
+
+    Rows are matched to features through oid_lookup; rows whose key isn't found are logged and skipped. Batches are
+    applied without rollback so a bad feature doesn't undo the rest of its batch.
+
+    Args:
+        feature_layer (arcgis.features.FeatureLayer): The layer to be updated
+        dataframe (pd.DataFrame): New data; every column is written to the field of the same name
+        key_column (str): The field that uniquely identifies each feature
+        oid_lookup (dict): {key: ObjectID} for the existing features
+        batch_size (int): Maximum number of features per request
+
+    Returns:
+        tuple(int, list, list): Number of features successfully updated, the keys of the rows AGOL failed to update,
+            and the keys that weren't found in oid_lookup
+    """
+
+    module_logger = logging.getLogger('erap')
+    oid_field = feature_layer.properties.objectIdField
+
+    updates, keys_not_found = _build_updates(dataframe, key_column, oid_field, oid_lookup)
+    if keys_not_found:
+        module_logger.warning(
+            'The following keys from the new data were not found in the existing dataset: %s', keys_not_found
+        )
+
+    rows_updated = 0
+    failed_keys = []
+    for batch_start in range(0, len(updates), batch_size):
+        batch = updates[batch_start:batch_start + batch_size]
+        module_logger.debug('Sending updates %s through %s', batch_start, batch_start + len(batch) - 1)
+        batch_keys = {update['attributes'][oid_field]: update['attributes'][key_column] for update in batch}
+        for result in feature_layer.edit_features(updates=batch, rollback_on_failure=False)['updateResults']:
+            if result['success']:
+                rows_updated += 1
+            else:
+                module_logger.warning('Failed to update ObjectID %s: %s', result['objectId'], result.get('error'))
+                failed_keys.append(batch_keys.get(result['objectId']))
+    module_logger.info('%s rows updated', rows_updated)
+
+    return rows_updated, failed_keys, keys_not_found
+
+
+class ObjectIdLookup:
+    """{key: ObjectID} lookup for feature_layer, loaded from the Cloud Storage cache the first time it's needed.
+
+    Keys missing from a cached lookup may have been added to the layer since the cache was built, so the lookup can be
+    refreshed from AGOL to confirm whether they're really absent.
+    """
+
+    def __init__(self, bucket, feature_layer, key_column):
+        self.bucket = bucket
+        self.feature_layer = feature_layer
+        self.key_column = key_column
+        self.is_cached = False
+        self._lookup = None
+
+    @property
+    def lookup(self):
+        """dict: {key: ObjectID}, loaded on first access"""
+
+        if self._lookup is None:
+            self._lookup, self.is_cached = _get_cached_oid_lookup(self.bucket, self.feature_layer, self.key_column)
+
+        return self._lookup
+
+    def refresh(self):
+        """Rebuild the lookup from AGOL and re-cache it"""
+
+        self._lookup = _rebuild_oid_lookup(self.bucket, self.feature_layer, self.key_column)
+        self.is_cached = False
+
+
+def _update_changed_rows(feature_layer, changed_rows, oid_lookup):
+    """Update the features for changed_rows, retrying keys missing from a cached lookup once it's refreshed from AGOL
+
+    Args:
+        feature_layer (arcgis.features.FeatureLayer): The layer to be updated
+        changed_rows (pd.DataFrame): Rows that changed since the last update
+        oid_lookup (ObjectIdLookup): The layer's ObjectIDs
+
+    Returns:
+        tuple(int, list): Number of features successfully updated and the keys of the rows AGOL failed to update
+    """
+
+    key_column = config.ERAP_KEY_COLUMN
+    rows_updated, failed_keys, keys_not_found = _update_features_in_batches(
+        feature_layer, changed_rows, key_column, oid_lookup.lookup, config.ERAP_UPDATE_BATCH_SIZE
+    )
+
+    if keys_not_found and oid_lookup.is_cached:
+        logging.getLogger('erap').info('Keys not found in the cached ObjectID lookup; retrying with a fresh lookup')
+        oid_lookup.refresh()
+        retry_rows = changed_rows[changed_rows[key_column].isin(keys_not_found)]
+        retry_updated, retry_failed_keys, _ = _update_features_in_batches(
+            feature_layer, retry_rows, key_column, oid_lookup.lookup, config.ERAP_UPDATE_BATCH_SIZE
+        )
+        rows_updated += retry_updated
+        failed_keys.extend(retry_failed_keys)
+
+    return rows_updated, failed_keys
+
+
+def _update_layer_from_csv(feature_layer, bucket, csv_data, previous_hashes):
+    """Update feature_layer with the csv rows that changed since the last update, one chunk at a time to cap memory use
+
+    A row whose hash is in previous_hashes is unchanged and isn't sent to AGOL. Failed edits may mean the cached
+    ObjectIDs are out of date, so the cached lookup is discarded if AGOL rejects any update and gets rebuilt on the
+    next run. A key missing from a cached lookup may have been added to the layer since, so the lookup is rebuilt from
+    AGOL once and those rows are retried; keys still missing after that are only logged.
+
+    The returned hashes leave out the rows AGOL failed to update so that only those rows are sent again next run.
+    Rows whose key a fresh lookup confirms isn't in the layer are kept, as resending them can't succeed until their
+    data changes.
+
+    Args:
+        feature_layer (arcgis.features.FeatureLayer): The layer to be updated
+        bucket (google.cloud.storage.Bucket): Bucket holding the cached ObjectID lookup
+        csv_data (bytes): Contents of the ERAP csv
+        previous_hashes (np.ndarray): Row hashes from the last fully-applied update
+
+    Returns:
+        tuple(int, int, np.ndarray): Number of changed rows, number of features successfully updated, and the hashes
+            of every csv row except the ones AGOL failed to update
+    """
+
+    module_logger = logging.getLogger('erap')
+
+    oid_lookup = ObjectIdLookup(bucket, feature_layer, config.ERAP_KEY_COLUMN)
+    row_hashes = [np.array([], dtype=np.uint64)]
+    rows_changed = 0
+    rows_updated = 0
+    failed_keys = []
+    for chunk in _read_csv_in_chunks(csv_data, config.ERAP_DATA_TYPES, config.ERAP_CSV_BLOCK_SIZE):
+        chunk_hashes = _get_row_hashes(chunk)
+
+        #: Unchanged chunks don't need the ObjectID lookup at all, so it's only loaded once there's something to update
+        changed_rows = chunk[~np.isin(chunk_hashes, previous_hashes)]
+        if changed_rows.empty:
+            row_hashes.append(chunk_hashes)
+            continue
+
+        rows_changed += len(changed_rows.index)
+        chunk_updated, chunk_failed_keys = _update_changed_rows(feature_layer, changed_rows, oid_lookup)
+        rows_updated += chunk_updated
+        failed_keys.extend(chunk_failed_keys)
+        row_hashes.append(chunk_hashes[~chunk[config.ERAP_KEY_COLUMN].isin(chunk_failed_keys).to_numpy()])
+
+    module_logger.info('%s rows changed since the last update', rows_changed)
+
+    if failed_keys:
+        module_logger.info('AGOL failed to update some rows; discarding cached ObjectID lookup')
+        try:
+            bucket.delete_blob(config.ERAP_OID_LOOKUP_BLOB_NAME)
+        except NotFound:
+            pass
+
+    return rows_changed, rows_updated, np.concatenate(row_hashes)
+
+
 def process():
     """Primary ERAP skid
     """
 
     start = datetime.now()
+    #: Shared by the log and data file names so the two can be matched up in the bucket
+    start_stamp = start.strftime('%Y%m%d-%H%M%S')
 
     secrets = SimpleNamespace(**_get_secrets())
 
     tempdir = TemporaryDirectory()
     tempdir_path = Path(tempdir.name)
-    log_name = f'{config.ERAP_LOG_NAME}_{start.strftime("%Y%m%d-%H%M%S")}.txt'
+    log_name = f'{config.ERAP_LOG_NAME}_{start_stamp}.txt'
     log_path = tempdir_path / log_name
 
-    erap_supervisor = _initialize(log_path, secrets.SENDGRID_API_KEY)
+    erap_supervisor, log_handlers = _initialize(log_path, secrets.SENDGRID_API_KEY)
 
-    module_logger = logging.getLogger('erap')
-
-    module_logger.debug('Logging into `%s` as `%s`', config.AGOL_ORG, secrets.AGOL_USER)
-    gis = arcgis.gis.GIS(config.AGOL_ORG, secrets.AGOL_USER, secrets.AGOL_PASSWORD)
-    erap_webmap_item = gis.content.get(config.ERAP_WEBMAP_ITEMID)  # pylint: disable=no-member
-
-    #: Load the latest data from FTP
-    module_logger.info('Getting data from FTP')
-    #: Get knownhosts path from the Cloud Function mount point; otherwise try a local copy
-    knownhosts = Path('/secrets/ftp/known_hosts/')
-    if not knownhosts.exists():
-        knownhosts = config.KNOWNHOSTS
-    erap_loader = SFTPLoader(secrets.SFTP_HOST, secrets.SFTP_USERNAME, secrets.SFTP_PASSWORD, knownhosts, tempdir_path)
-    files_downloaded = erap_loader.download_sftp_folder_contents(sftp_folder=secrets.SFTP_FOLDER)
-    dataframe = erap_loader.read_csv_into_dataframe(config.ERAP_FILE_NAME, config.ERAP_DATA_TYPES)
-
-    #: Save the source file to Cloud storage for future reference; bucket should have an age-based retention policy
-    module_logger.info('Saving data file to Cloud Storage')
-    file_base_name = str(config.ERAP_FILE_NAME).split('.', maxsplit=1)[0]
-    blob_name = f'{file_base_name}_{start.strftime("%Y%m%d-%H%M%S")}.csv'
-    file_blob = storage.Client() \
-                       .bucket(STORAGE_BUCKET) \
-                       .blob(blob_name)
-    file_blob.upload_from_filename(tempdir_path / config.ERAP_FILE_NAME)
-
-    #: Update the AGOL data
-    module_logger.info('Updating data in AGOL')
-    erap_updater = FeatureServiceInlineUpdater(gis, dataframe, config.ERAP_KEY_COLUMN)
-    rows_updated = erap_updater.update_existing_features_in_hosted_feature_layer(
-        config.ERAP_FEATURE_LAYER_ITEMID, list(config.ERAP_DATA_TYPES.keys())
-    )
-
-    #: Reclassify the break values on the webmap's color ramp
-    module_logger.info('Reclassifying the map')
-    erap_reclassifier = ColorRampReclassifier(erap_webmap_item, gis)
-    success = erap_reclassifier.update_color_ramp_values(config.ERAP_LAYER_NAME, config.ERAP_CLASSIFICATION_COLUMN)
-
-    reclassifier_result = 'Success'
-    if not success:
-        reclassifier_result = 'Failure'
-
-    end = datetime.now()
-
-    summary_message = MessageDetails()
-    summary_message.subject = 'ERAP Update Summary'
-    summary_rows = [
-        f'ERAP update {start.strftime("%Y-%m-%d")}',
-        '=' * 20,
-        '',
-        f'Start time: {start.strftime("%H:%M:%S")}',
-        f'End time: {end.strftime("%H:%M:%S")}',
-        f'Duration: {str(end-start)}',
-        f'{files_downloaded} files downloaded from SFTP',
-        f'{rows_updated} rows updated in Feature Service',
-        f'Reclassifier webmap update operation: {reclassifier_result}',
-    ]
-    summary_message.message = '\n'.join(summary_rows)
-    summary_message.attachments = tempdir_path / log_name
-
-    erap_supervisor.notify(summary_message)
-
-    module_logger.info('Saving log to Cloud Storage')
-    log_blob = storage.Client() \
-                      .bucket(STORAGE_BUCKET) \
-                      .blob(log_name)
-    log_blob.upload_from_filename(tempdir_path / log_name)
+    try:
+        module_logger = logging.getLogger('erap')
+
+        module_logger.debug('Logging into `%s` as `%s`', config.AGOL_ORG, secrets.AGOL_USER)
+        gis = _get_gis(config.AGOL_ORG, secrets.AGOL_USER, secrets.AGOL_PASSWORD)
+        erap_webmap_item = gis.content.get(config.ERAP_WEBMAP_ITEMID)  # pylint: disable=no-member
+        erap_feature_layer = arcgis.features.FeatureLayer.fromitem(
+            gis.content.get(config.ERAP_FEATURE_LAYER_ITEMID)  # pylint: disable=no-member
+        )
+        bucket = _get_storage_client().bucket(STORAGE_BUCKET)
+
+        #: Load the latest data from FTP
+        module_logger.info('Getting data from FTP')
+        #: Get knownhosts path from the Cloud Function mount point; otherwise try a local copy
+        knownhosts = Path('/secrets/ftp/known_hosts/')
+        if not knownhosts.exists():
+            knownhosts = config.KNOWNHOSTS
+        erap_loader = PipelinedSFTPLoader(
+            secrets.SFTP_HOST,
+            secrets.SFTP_USERNAME,
+            secrets.SFTP_PASSWORD,
+            knownhosts,
+            config.SFTP_MAX_CONCURRENT_REQUESTS,
+            config.SFTP_MAX_REQUEST_SIZE,
+        )
+        erap_data = erap_loader.download_sftp_file_contents(config.ERAP_FILE_NAME, sftp_folder=secrets.SFTP_FOLDER)
+
+        #: Save the source file to Cloud storage for future reference; bucket should have an age-based retention policy
+        module_logger.info('Saving data file to Cloud Storage')
+        file_base_name = str(config.ERAP_FILE_NAME).split('.', maxsplit=1)[0]
+        blob_name = f'{file_base_name}_{start_stamp}.csv'
+        file_blob = bucket.blob(blob_name, chunk_size=config.GCS_UPLOAD_CHUNK_SIZE)
+
+        #: GCS and AGOL are independent, so upload the file in the background while AGOL is updated
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            file_upload = executor.submit(file_blob.upload_from_string, erap_data, content_type='text/csv')
+
+            #: Only rows that changed since the last fully-applied update are sent to AGOL
+            module_logger.info('Updating changed data in AGOL')
+            rows_changed, rows_updated, row_hashes = _update_layer_from_csv(
+                erap_feature_layer, bucket, erap_data, _load_row_hashes(bucket)
+            )
+
+            #: Re-raises any upload error
+            file_upload.result()
+
+        reclassifier_result = 'Skipped, data unchanged'
+        if rows_changed:
+            #: Reclassify the break values on the webmap's color ramp
+            module_logger.info('Reclassifying the map')
+            erap_reclassifier = AttributeColorRampReclassifier(erap_webmap_item, gis)
+            success = erap_reclassifier.update_color_ramp_values(
+                config.ERAP_LAYER_NAME, config.ERAP_CLASSIFICATION_COLUMN
+            )
+
+            reclassifier_result = 'Success'
+            if not success:
+                reclassifier_result = 'Failure'
+
+            #: Only remember the rows once the map reflects them; rows AGOL rejected are already left out of row_hashes
+            if success:
+                module_logger.debug('Saving %s row hashes', len(row_hashes))
+                _save_row_hashes(bucket, row_hashes)
+
+        end = datetime.now()
+
+        summary_message = MessageDetails()
+        summary_message.subject = 'ERAP Update Summary'
+        summary_rows = [
+            f'ERAP update {start.strftime("%Y-%m-%d")}',
+            '=' * 20,
+            '',
+            f'Start time: {start.strftime("%H:%M:%S")}',
+            f'End time: {end.strftime("%H:%M:%S")}',
+            f'Duration: {str(end-start)}',
+            f'{config.ERAP_FILE_NAME} ({len(erap_data)} bytes) downloaded from SFTP',
+            f'{rows_changed} rows changed since the last update',
+            f'{rows_updated} rows updated in Feature Service',
+            f'Reclassifier webmap update operation: {reclassifier_result}',
+        ]
+        summary_message.message = '\n'.join(summary_rows)
+        summary_message.attachments = tempdir_path / log_name
+
+        module_logger.info('Saving log to Cloud Storage')
+    finally:
+        #: Close out the log file so it's complete before it's read
+        _detach_log_handlers(log_handlers)
+
+    #: Upload the log while the summary email is sent; both only read the log file
+    log_blob = bucket.blob(log_name, chunk_size=config.GCS_UPLOAD_CHUNK_SIZE)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        log_upload = executor.submit(_upload_file, log_blob, log_path, 'text/plain')
+        erap_supervisor.notify(summary_message)
+        log_upload.result()
 
     #: Try to clean up the tempdir (we don't use a context manager); log any errors as a heads up
     #: This dir shouldn't persist between cloud function calls, but in case it does, we try to clean it up
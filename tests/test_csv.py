@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from erap import main
+
+
+def test_read_csv_in_chunks_splits_blocks_and_applies_types():
+    csv_data = b'84101,1,10.5\n84102,2,20\n84103,3,30\n'
+
+    chunks = list(main._read_csv_in_chunks(csv_data, {'zip5': str, 'Count_': str, 'Amount': np.float64}, 16))
+    dataframe = pd.concat(chunks)
+
+    assert len(chunks) > 1
+    assert list(dataframe.columns) == ['zip5', 'Count_', 'Amount']
+    assert dataframe['zip5'].tolist() == ['84101', '84102', '84103']
+    assert dataframe['Amount'].tolist() == [10.5, 20.0, 30.0]
+
+
+def test_read_csv_in_chunks_reads_empty_strings_as_null():
+    chunk = next(main._read_csv_in_chunks(b'84101,,10.5\n', {'zip5': str, 'Count_': str, 'Amount': np.float64}))
+
+    assert pd.isna(chunk.loc[0, 'Count_'])
+
+
+def test_read_csv_in_chunks_warns_and_yields_nothing_for_empty_csv(caplog):
+    chunks = list(main._read_csv_in_chunks(b'', {'zip5': str, 'Count_': str, 'Amount': np.float64}))
+
+    assert chunks == []
+    assert 'csv contains no rows' in caplog.text
+
+
+def test_get_row_hashes_only_changes_for_changed_rows():
+    dataframe = pd.DataFrame({'zip5': ['84101', '84102'], 'Amount': [1.0, 2.0]})
+    changed = pd.DataFrame({'zip5': ['84101', '84102'], 'Amount': [1.0, 2.5]})
+
+    hashes = main._get_row_hashes(dataframe)
+    changed_hashes = main._get_row_hashes(changed)
+
+    assert hashes.dtype == np.uint64
+    assert hashes[0] == changed_hashes[0]
+    assert hashes[1] != changed_hashes[1]
+
+
+def test_save_and_load_row_hashes_round_trip(mocker):
+    bucket_mock = mocker.Mock()
+    row_hashes = np.array([1, 2**64 - 1], dtype=np.uint64)
+
+    main._save_row_hashes(bucket_mock, row_hashes)
+    saved_bytes = bucket_mock.blob.return_value.upload_from_string.call_args.args[0]
+    bucket_mock.get_blob.return_value.download_as_bytes.return_value = saved_bytes
+
+    np.testing.assert_array_equal(main._load_row_hashes(bucket_mock), row_hashes)
+
+
+def test_load_row_hashes_returns_empty_without_saved_hashes(mocker):
+    bucket_mock = mocker.Mock()
+    bucket_mock.get_blob.return_value = None
+
+    assert main._load_row_hashes(bucket_mock).size == 0
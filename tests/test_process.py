@@ -0,0 +1,98 @@
+import logging
+
+import numpy as np
+import pytest
+
+from erap import main
+
+
+@pytest.fixture
+def process_mocks(mocker):
+    mocker.patch(
+        'erap.main._get_secrets',
+        return_value={
+            'SENDGRID_API_KEY': 'key',
+            'AGOL_USER': 'user',
+            'AGOL_PASSWORD': 'password',
+            'SFTP_HOST': 'host',
+            'SFTP_USERNAME': 'user',
+            'SFTP_PASSWORD': 'password',
+            'SFTP_FOLDER': 'upload',
+        }
+    )
+    supervisor_mock = mocker.Mock()
+    handler = logging.NullHandler()
+    logging.getLogger('erap').addHandler(handler)
+    logging.getLogger('palletjack').addHandler(handler)
+    mocker.patch('erap.main._initialize', return_value=(supervisor_mock, [handler]))
+    mocker.patch('erap.main._get_gis')
+    mocker.patch('erap.main.arcgis')
+    mocker.patch('erap.main._get_storage_client')
+    mocker.patch('erap.main.PipelinedSFTPLoader').return_value.download_sftp_file_contents.return_value = b'data'
+    mocker.patch('erap.main._load_row_hashes')
+    mocker.patch('erap.main._upload_file')
+
+    return {
+        'supervisor': supervisor_mock,
+        'handler': handler,
+        'update': mocker.patch('erap.main._update_layer_from_csv'),
+        'reclassifier': mocker.patch('erap.main.AttributeColorRampReclassifier'),
+        'save_hashes': mocker.patch('erap.main._save_row_hashes'),
+    }
+
+
+def test_process_skips_reclassify_and_hash_save_without_changed_rows(process_mocks):
+    process_mocks['update'].return_value = (0, 0, np.array([1], dtype=np.uint64))
+
+    main.process()
+
+    process_mocks['reclassifier'].assert_not_called()
+    process_mocks['save_hashes'].assert_not_called()
+    summary = process_mocks['supervisor'].notify.call_args.args[0].message
+    assert 'Reclassifier webmap update operation: Skipped, data unchanged' in summary
+
+
+def test_process_saves_hashes_after_successful_reclassify(process_mocks):
+    row_hashes = np.array([1, 2], dtype=np.uint64)
+    process_mocks['update'].return_value = (2, 2, row_hashes)
+    process_mocks['reclassifier'].return_value.update_color_ramp_values.return_value = True
+
+    main.process()
+
+    process_mocks['save_hashes'].assert_called_once()
+    assert process_mocks['save_hashes'].call_args.args[1] is row_hashes
+    summary = process_mocks['supervisor'].notify.call_args.args[0].message
+    assert 'Reclassifier webmap update operation: Success' in summary
+
+
+def test_process_doesnt_save_hashes_when_reclassify_fails(process_mocks):
+    process_mocks['update'].return_value = (2, 2, np.array([1, 2], dtype=np.uint64))
+    process_mocks['reclassifier'].return_value.update_color_ramp_values.return_value = False
+
+    main.process()
+
+    process_mocks['save_hashes'].assert_not_called()
+    summary = process_mocks['supervisor'].notify.call_args.args[0].message
+    assert 'Reclassifier webmap update operation: Failure' in summary
+
+
+def test_process_detaches_log_handlers_when_update_fails(process_mocks):
+    process_mocks['update'].side_effect = RuntimeError('AGOL is down')
+
+    with pytest.raises(RuntimeError, match='AGOL is down'):
+        main.process()
+
+    assert process_mocks['handler'] not in logging.getLogger('erap').handlers
+    assert process_mocks['handler'] not in logging.getLogger('palletjack').handlers
+
+
+def test_detach_log_handlers_removes_and_closes_handlers(mocker):
+    handler = mocker.Mock(spec=logging.Handler, level=logging.DEBUG)
+    logging.getLogger('erap').addHandler(handler)
+    logging.getLogger('palletjack').addHandler(handler)
+
+    main._detach_log_handlers([handler])
+
+    assert handler not in logging.getLogger('erap').handlers
+    assert handler not in logging.getLogger('palletjack').handlers
+    handler.close.assert_called_once()
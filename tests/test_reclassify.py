@@ -0,0 +1,45 @@
+import json
+
+from erap import main
+
+
+def test_attribute_reclassifier_queries_webmap_layer_without_geometry(mocker):
+    webmap_data = {
+        'operationalLayers': [{
+            'title': 'other',
+            'itemId': 'other_item'
+        }, {
+            'title': 'layer',
+            'itemId': 'layer_item',
+            'layerDefinition': {
+                'drawingInfo': {
+                    'renderer': {
+                        'visualVariables': [{
+                            'stops': [{
+                                'value': 0
+                            }, {
+                                'value': 0
+                            }, {
+                                'value': 0
+                            }]
+                        }]
+                    }
+                }
+            }
+        }]
+    }
+    webmap_mock = mocker.Mock()
+    webmap_mock.get_data.side_effect = lambda: json.loads(json.dumps(webmap_data))
+    gis_mock = mocker.Mock()
+    layer_mock = mocker.Mock()
+    gis_mock.content.get.return_value.layers = [layer_mock]
+    layer_mock.query.return_value.features = [mocker.Mock(attributes={'Amount': value}) for value in [0, 10, 20]]
+
+    reclassifier = main.AttributeColorRampReclassifier(webmap_mock, gis_mock)
+    reclassifier.update_color_ramp_values('layer', 'Amount', stops=3)
+
+    gis_mock.content.get.assert_called_once_with('layer_item')
+    layer_mock.query.assert_called_once_with(out_fields='*', return_geometry=False)
+    updated_data = json.loads(webmap_mock.update.call_args.kwargs['item_properties']['text'])
+    stops = updated_data['operationalLayers'][1]['layerDefinition']['drawingInfo']['renderer']['visualVariables'][0]
+    assert [stop['value'] for stop in stops['stops']] == [0, 10, 20]
@@ -0,0 +1,88 @@
+import io
+
+import pytest
+
+from erap import main
+
+
+def test_reused_sftp_reuses_cached_connection(mocker):
+    main._connect_sftp.cache_clear()
+    ssh_client_mock = mocker.Mock()
+    ssh_client_mock.get_transport.return_value.is_active.return_value = True
+    mocker.patch('paramiko.SSHClient', return_value=ssh_client_mock)
+
+    with main.ReusedSFTP('host', 'user', 'password', 'known_hosts') as first_sftp:
+        pass
+    with main.ReusedSFTP('host', 'user', 'password', 'known_hosts') as second_sftp:
+        pass
+
+    assert first_sftp is second_sftp
+    ssh_client_mock.connect.assert_called_once()
+
+
+def test_reused_sftp_reconnects_when_cached_connection_dropped(mocker):
+    main._connect_sftp.cache_clear()
+    dropped_client_mock = mocker.Mock()
+    dropped_client_mock.get_transport.return_value.is_active.return_value = False
+    new_client_mock = mocker.Mock()
+    mocker.patch('paramiko.SSHClient', side_effect=[dropped_client_mock, new_client_mock])
+
+    with main.ReusedSFTP('host', 'user', 'password', 'known_hosts') as sftp:
+        pass
+
+    assert sftp is new_client_mock.open_sftp.return_value
+    dropped_client_mock.close.assert_called_once()
+
+
+def test_reused_sftp_reconnects_when_cached_connection_is_half_open(mocker):
+    main._connect_sftp.cache_clear()
+    stale_client_mock = mocker.Mock()
+    stale_client_mock.get_transport.return_value.is_active.return_value = True
+    stale_client_mock.open_sftp.return_value.normalize.side_effect = EOFError
+    new_client_mock = mocker.Mock()
+    mocker.patch('paramiko.SSHClient', side_effect=[stale_client_mock, new_client_mock])
+
+    with main.ReusedSFTP('host', 'user', 'password', 'known_hosts') as sftp:
+        pass
+
+    assert sftp is new_client_mock.open_sftp.return_value
+    stale_client_mock.close.assert_called_once()
+
+
+def test_connect_sftp_closes_client_when_connect_fails(mocker):
+    main._connect_sftp.cache_clear()
+    ssh_client_mock = mocker.Mock()
+    ssh_client_mock.connect.side_effect = OSError('Connection refused')
+    mocker.patch('paramiko.SSHClient', return_value=ssh_client_mock)
+
+    with pytest.raises(OSError, match='Connection refused'):
+        main._connect_sftp('host', 'user', 'password', 'known_hosts')
+
+    ssh_client_mock.close.assert_called_once()
+
+
+def test_download_sftp_file_contents_prefetches_into_memory(mocker):
+    sftp_mock = mocker.Mock()
+    sftp_mock.stat.return_value.st_size = 9
+    remote_file = io.BytesIO(b'1,2,3\n4,5')
+    remote_file.prefetch = mocker.Mock()
+    sftp_mock.open.return_value = remote_file
+    mocker.patch('erap.main.ReusedSFTP.__enter__', return_value=sftp_mock)
+    loader = main.PipelinedSFTPLoader('host', 'user', 'password', 'known_hosts', 16, 1024)
+
+    contents = loader.download_sftp_file_contents('data.csv', 'upload')
+
+    assert contents == b'1,2,3\n4,5'
+    sftp_mock.open.assert_called_once_with('upload/data.csv', 'rb', bufsize=1024)
+    remote_file.prefetch.assert_called_once_with(9, 16)
+    assert remote_file.MAX_REQUEST_SIZE == 1024
+
+
+def test_download_sftp_file_contents_raises_on_missing_file(mocker):
+    sftp_mock = mocker.Mock()
+    sftp_mock.stat.side_effect = FileNotFoundError
+    mocker.patch('erap.main.ReusedSFTP.__enter__', return_value=sftp_mock)
+    loader = main.PipelinedSFTPLoader('host', 'user', 'password', 'known_hosts')
+
+    with pytest.raises(FileNotFoundError, match='File `data.csv` or folder `upload` not found'):
+        loader.download_sftp_file_contents('data.csv', 'upload')
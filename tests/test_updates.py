@@ -0,0 +1,263 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from erap import main
+
+
+def test_get_key_to_oid_lookup_maps_keys_to_objectids(mocker):
+    layer_mock = mocker.Mock()
+    layer_mock.properties.objectIdField = 'OBJECTID'
+    first_feature = mocker.Mock(attributes={'OBJECTID': 1, 'zip5': '84101'})
+    second_feature = mocker.Mock(attributes={'OBJECTID': 2, 'zip5': '84102'})
+    layer_mock.query.return_value.features = [first_feature, second_feature]
+
+    lookup = main._get_key_to_oid_lookup(layer_mock, 'zip5')
+
+    assert lookup == {'84101': 1, '84102': 2}
+    layer_mock.query.assert_called_once_with(out_fields='zip5', return_geometry=False)
+
+
+def test_update_features_in_batches_sends_batches_of_batch_size(mocker):
+    layer_mock = mocker.Mock()
+    layer_mock.properties.objectIdField = 'OBJECTID'
+    layer_mock.edit_features.side_effect = [
+        {
+            'updateResults': [{
+                'objectId': 1,
+                'success': True
+            }, {
+                'objectId': 2,
+                'success': True
+            }]
+        },
+        {
+            'updateResults': [{
+                'objectId': 3,
+                'success': True
+            }]
+        },
+    ]
+    dataframe = pd.DataFrame({'zip5': ['84101', '84102', '84103'], 'Amount': [1.0, 2.0, 3.0]})
+    oid_lookup = {'84101': 1, '84102': 2, '84103': 3}
+
+    rows_updated, failed_keys, keys_not_found = main._update_features_in_batches(
+        layer_mock, dataframe, 'zip5', oid_lookup, 2
+    )
+
+    assert rows_updated == 3
+    assert failed_keys == []
+    assert keys_not_found == []
+    first_batch = layer_mock.edit_features.call_args_list[0].kwargs['updates']
+    second_batch = layer_mock.edit_features.call_args_list[1].kwargs['updates']
+    assert [update['attributes']['OBJECTID'] for update in first_batch] == [1, 2]
+    assert second_batch == [{'attributes': {'OBJECTID': 3, 'zip5': '84103', 'Amount': 3.0}}]
+    assert layer_mock.edit_features.call_args_list[0].kwargs['rollback_on_failure'] is False
+
+
+def test_update_features_in_batches_sends_nulls_as_none(mocker):
+    layer_mock = mocker.Mock()
+    layer_mock.properties.objectIdField = 'OBJECTID'
+    layer_mock.edit_features.return_value = {'updateResults': [{'objectId': 1, 'success': True}]}
+    dataframe = pd.DataFrame({'zip5': ['84101'], 'Count_': [None], 'Amount': [np.nan]})
+
+    main._update_features_in_batches(layer_mock, dataframe, 'zip5', {'84101': 1}, 500)
+
+    assert layer_mock.edit_features.call_args.kwargs['updates'] == [{
+        'attributes': {
+            'OBJECTID': 1,
+            'zip5': '84101',
+            'Count_': None,
+            'Amount': None
+        }
+    }]
+
+
+def test_update_features_in_batches_skips_missing_keys_and_counts_only_successes(mocker, caplog):
+    layer_mock = mocker.Mock()
+    layer_mock.properties.objectIdField = 'OBJECTID'
+    layer_mock.edit_features.return_value = {
+        'updateResults': [{
+            'objectId': 1,
+            'success': True
+        }, {
+            'objectId': 2,
+            'success': False
+        }]
+    }
+    dataframe = pd.DataFrame({'zip5': ['84101', '84102', '84199'], 'Amount': [1.0, 2.0, 3.0]})
+    oid_lookup = {'84101': 1, '84102': 2}
+
+    rows_updated, failed_keys, keys_not_found = main._update_features_in_batches(
+        layer_mock, dataframe, 'zip5', oid_lookup, 500
+    )
+
+    assert rows_updated == 1
+    assert failed_keys == ['84102']
+    assert keys_not_found == ['84199']
+    assert "not found in the existing dataset: ['84199']" in caplog.text
+    assert 'Failed to update ObjectID 2' in caplog.text
+
+
+def test_get_cached_oid_lookup_uses_fresh_cache(mocker):
+    bucket_mock = mocker.Mock()
+    bucket_mock.get_blob.return_value.updated = datetime.now(timezone.utc) - timedelta(days=1)
+    bucket_mock.get_blob.return_value.download_as_bytes.return_value = b'{"84101": 1}'
+    layer_mock = mocker.Mock()
+    layer_mock.query.return_value = {'objectIdFieldName': 'OBJECTID', 'objectIds': [1]}
+    lookup_mock = mocker.patch('erap.main._get_key_to_oid_lookup')
+
+    lookup, is_cached = main._get_cached_oid_lookup(bucket_mock, layer_mock, 'zip5')
+
+    assert lookup == {'84101': 1}
+    assert is_cached
+    layer_mock.query.assert_called_once_with(return_ids_only=True)
+    lookup_mock.assert_not_called()
+
+
+def test_get_cached_oid_lookup_rebuilds_cache_with_different_objectids(mocker):
+    bucket_mock = mocker.Mock()
+    bucket_mock.get_blob.return_value.updated = datetime.now(timezone.utc) - timedelta(days=1)
+    bucket_mock.get_blob.return_value.download_as_bytes.return_value = b'{"84101": 1}'
+    layer_mock = mocker.Mock()
+    layer_mock.query.return_value = {'objectIdFieldName': 'OBJECTID', 'objectIds': [7]}
+    mocker.patch('erap.main._get_key_to_oid_lookup', return_value={'84101': 7})
+
+    lookup, is_cached = main._get_cached_oid_lookup(bucket_mock, layer_mock, 'zip5')
+
+    assert lookup == {'84101': 7}
+    assert not is_cached
+    bucket_mock.blob.return_value.upload_from_string.assert_called_once_with(
+        '{"84101": 7}', content_type='application/json'
+    )
+
+
+def test_get_cached_oid_lookup_rebuilds_stale_cache(mocker):
+    bucket_mock = mocker.Mock()
+    bucket_mock.get_blob.return_value.updated = datetime.now(timezone.utc) - timedelta(days=8)
+    mocker.patch('erap.main._get_key_to_oid_lookup', return_value={'84101': 2})
+
+    lookup, is_cached = main._get_cached_oid_lookup(bucket_mock, mocker.Mock(), 'zip5')
+
+    assert lookup == {'84101': 2}
+    assert not is_cached
+    bucket_mock.blob.return_value.upload_from_string.assert_called_once_with(
+        '{"84101": 2}', content_type='application/json'
+    )
+
+
+def test_get_cached_oid_lookup_builds_missing_cache(mocker):
+    bucket_mock = mocker.Mock()
+    bucket_mock.get_blob.return_value = None
+    mocker.patch('erap.main._get_key_to_oid_lookup', return_value={'84101': 3})
+
+    lookup, is_cached = main._get_cached_oid_lookup(bucket_mock, mocker.Mock(), 'zip5')
+
+    assert lookup == {'84101': 3}
+    assert not is_cached
+    bucket_mock.blob.return_value.upload_from_string.assert_called_once()
+
+
+def test_update_layer_from_csv_only_sends_changed_rows(mocker):
+    csv_data = b'84101,1,10.5,2021-01-01\n84102,2,20,2021-01-01\n'
+    first_row = next(main._read_csv_in_chunks(csv_data, main.config.ERAP_DATA_TYPES)).iloc[:1]
+    previous_hashes = main._get_row_hashes(first_row)
+    mocker.patch('erap.main._get_cached_oid_lookup', return_value=({'84101': 1, '84102': 2}, False))
+    update_mock = mocker.patch('erap.main._update_features_in_batches', return_value=(1, [], []))
+
+    rows_changed, rows_updated, row_hashes = main._update_layer_from_csv(
+        mocker.Mock(), mocker.Mock(), csv_data, previous_hashes
+    )
+
+    assert (rows_changed, rows_updated) == (1, 1)
+    assert update_mock.call_args.args[1]['zip5'].tolist() == ['84102']
+    assert len(row_hashes) == 2
+
+
+def test_update_layer_from_csv_skips_agol_when_nothing_changed(mocker):
+    csv_data = b'84101,1,10.5,2021-01-01\n'
+    chunk = next(main._read_csv_in_chunks(csv_data, main.config.ERAP_DATA_TYPES))
+    lookup_mock = mocker.patch('erap.main._get_cached_oid_lookup')
+    update_mock = mocker.patch('erap.main._update_features_in_batches')
+
+    rows_changed, rows_updated, _ = main._update_layer_from_csv(
+        mocker.Mock(), mocker.Mock(), csv_data, main._get_row_hashes(chunk)
+    )
+
+    assert (rows_changed, rows_updated) == (0, 0)
+    lookup_mock.assert_not_called()
+    update_mock.assert_not_called()
+
+
+def test_update_layer_from_csv_discards_oid_lookup_after_failed_updates(mocker):
+    csv_data = b'84101,1,10.5,2021-01-01\n'
+    bucket_mock = mocker.Mock()
+    mocker.patch('erap.main._get_cached_oid_lookup', return_value=({'84101': 1}, False))
+    mocker.patch('erap.main._update_features_in_batches', return_value=(0, ['84101'], []))
+
+    main._update_layer_from_csv(mocker.Mock(), bucket_mock, csv_data, np.array([], dtype=np.uint64))
+
+    bucket_mock.delete_blob.assert_called_once_with(main.config.ERAP_OID_LOOKUP_BLOB_NAME)
+
+
+def test_update_layer_from_csv_keeps_oid_lookup_and_hashes_when_fresh_lookup_confirms_keys_missing(mocker):
+    csv_data = b'84101,1,10.5,2021-01-01\n84199,2,20,2021-01-01\n'
+    bucket_mock = mocker.Mock()
+    mocker.patch('erap.main._get_cached_oid_lookup', return_value=({'84101': 1}, False))
+    layer_mock = mocker.Mock()
+    layer_mock.properties.objectIdField = 'OBJECTID'
+    layer_mock.edit_features.return_value = {'updateResults': [{'objectId': 1, 'success': True}]}
+
+    _, _, row_hashes = main._update_layer_from_csv(layer_mock, bucket_mock, csv_data, np.array([], dtype=np.uint64))
+
+    bucket_mock.delete_blob.assert_not_called()
+    assert len(row_hashes) == 2
+
+
+def test_update_layer_from_csv_leaves_failed_rows_out_of_hashes(mocker):
+    csv_data = b'84101,1,10.5,2021-01-01\n84102,2,20,2021-01-01\n84199,3,30,2021-01-01\n'
+    chunk = next(main._read_csv_in_chunks(csv_data, main.config.ERAP_DATA_TYPES))
+    mocker.patch('erap.main._get_cached_oid_lookup', return_value=({'84101': 1, '84102': 2}, False))
+    mocker.patch('erap.main._update_features_in_batches', return_value=(1, ['84102'], []))
+
+    _, _, row_hashes = main._update_layer_from_csv(
+        mocker.Mock(), mocker.Mock(), csv_data, np.array([], dtype=np.uint64)
+    )
+
+    np.testing.assert_array_equal(row_hashes, main._get_row_hashes(chunk)[[0, 2]])
+
+
+def test_update_layer_from_csv_retries_keys_missing_from_cached_lookup(mocker):
+    csv_data = b'84101,1,10.5,2021-01-01\n84102,2,20,2021-01-01\n'
+    bucket_mock = mocker.Mock()
+    mocker.patch('erap.main._get_cached_oid_lookup', return_value=({'84101': 1}, True))
+    mocker.patch('erap.main._get_key_to_oid_lookup', return_value={'84101': 1, '84102': 2})
+    layer_mock = mocker.Mock()
+    layer_mock.properties.objectIdField = 'OBJECTID'
+    layer_mock.edit_features.side_effect = [
+        {
+            'updateResults': [{
+                'objectId': 1,
+                'success': True
+            }]
+        },
+        {
+            'updateResults': [{
+                'objectId': 2,
+                'success': True
+            }]
+        },
+    ]
+
+    rows_changed, rows_updated, row_hashes = main._update_layer_from_csv(
+        layer_mock, bucket_mock, csv_data, np.array([], dtype=np.uint64)
+    )
+
+    assert (rows_changed, rows_updated) == (2, 2)
+    retried_update = layer_mock.edit_features.call_args_list[1].kwargs['updates']
+    assert [update['attributes']['OBJECTID'] for update in retried_update] == [2]
+    bucket_mock.blob.return_value.upload_from_string.assert_called_once_with(
+        '{"84101": 1, "84102": 2}', content_type='application/json'
+    )
+    assert len(row_hashes) == 2